@@ -16,12 +16,21 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 from typing import List, Optional, Callable
+from functools import lru_cache
 from gi.repository import Gdk
 from gradia.overlay.drawing_actions import DrawingMode
 import re
 import json
 from gradia.backend.settings import Settings
 
+@lru_cache(maxsize=64)
+def _parse_rgba_str(s: str) -> tuple[float, float, float, float]:
+    m = re.match(r"rgba\(([\d.]+), ([\d.]+), ([\d.]+), ([\d.]+)\)", s)
+    if not m:
+        return (0.0, 0.0, 0.0, 1.0)
+    r, g, b, a = map(float, m.groups())
+    return (r, g, b, a)
+
 class ToolOption:
     def __init__(
         self,
@@ -42,18 +51,21 @@ class ToolOption:
         self._font = font or "Adwaita Sans"
         self._on_change_callback = on_change_callback
         self._is_temporary = is_temporary
+        self._revision = 0
 
     def _rgba_to_str(self, rgba: Gdk.RGBA) -> str:
         return f"rgba({rgba.red:.2f}, {rgba.green:.2f}, {rgba.blue:.2f}, {rgba.alpha:.2f})"
 
     def _str_to_rgba(self, s: str) -> Gdk.RGBA:
-        m = re.match(r"rgba\(([\d.]+), ([\d.]+), ([\d.]+), ([\d.]+)\)", s)
-        if not m:
-            return Gdk.RGBA(0,0,0,1)
-        r, g, b, a = map(float, m.groups())
+        r, g, b, a = _parse_rgba_str(s)
         return Gdk.RGBA(r, g, b, a)
 
+    @property
+    def revision(self) -> int:
+        return self._revision
+
     def _notify_change(self):
+        self._revision += 1
         if self._on_change_callback and not self._is_temporary:
             self._on_change_callback(self)
 
@@ -78,6 +90,10 @@ class ToolOption:
             self._primary_color_str = new_str
             self._notify_change()
 
+    @property
+    def primary_rgba(self) -> tuple[float, float, float, float]:
+        return _parse_rgba_str(self._primary_color_str)
+
     @property
     def fill_color(self) -> Gdk.RGBA:
         return self._str_to_rgba(self._fill_color_str)
@@ -89,6 +105,10 @@ class ToolOption:
             self._fill_color_str = new_str
             self._notify_change()
 
+    @property
+    def fill_rgba(self) -> tuple[float, float, float, float]:
+        return _parse_rgba_str(self._fill_color_str)
+
     @property
     def border_color(self) -> Gdk.RGBA:
         return self._str_to_rgba(self._border_color_str)
@@ -100,6 +120,10 @@ class ToolOption:
             self._border_color_str = new_str
             self._notify_change()
 
+    @property
+    def border_rgba(self) -> tuple[float, float, float, float]:
+        return _parse_rgba_str(self._border_color_str)
+
     @property
     def font(self) -> str:
         return self._font
@@ -153,6 +177,7 @@ class ToolOption:
         )
 
     def update_without_notify(self, **kwargs):
+        self._revision += 1
         if 'size' in kwargs:
             self._size = kwargs['size']
         if 'primary_color' in kwargs:
@@ -17,12 +17,14 @@
 
 import cairo
 
-from typing import Callable
+from dataclasses import dataclass
 from gi.repository import Gtk, Gdk, Gio, Pango, PangoCairo, GdkPixbuf
 from enum import Enum
+from functools import lru_cache
 import math
 from gradia.backend.logger import Logger
 from gradia.utils.colors import has_visible_color
+import threading
 import time
 import unicodedata
 
@@ -30,6 +32,103 @@ logging = Logger()
 
 start_time_seed = int(time.time())
 
+def _create_scratch_context() -> cairo.Context:
+    # Measuring runs on whichever thread asks for bounds, and a Cairo context
+    # must not be shared between threads, so every cache miss gets its own
+    return cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1))
+
+
+@lru_cache(maxsize=256)
+def _get_text_extents(text: str, font: str, font_size: float) -> tuple[int, int]:
+    layout = PangoCairo.create_layout(_create_scratch_context())
+    font_desc = Pango.FontDescription()
+    font_desc.set_family(font)
+    font_desc.set_size(int(font_size * Pango.SCALE))
+    layout.set_font_description(font_desc)
+    layout.set_text(text, -1)
+    layout.set_alignment(Pango.Alignment.CENTER)
+
+    _, logical_rect = layout.get_extents()
+    return int(logical_rect.width / Pango.SCALE), int(logical_rect.height / Pango.SCALE)
+
+
+NUMBER_REFERENCE_FONT_SIZE = 100.0
+
+
+@lru_cache(maxsize=128)
+def _get_number_extents(text: str) -> tuple[float, float, float]:
+    # Toy font extents scale linearly with the font size, measure once at a
+    # reference size and return x bearing, width and height per unit size
+    cr = _create_scratch_context()
+    cr.select_font_face("Sans", cairo.FontSlant.NORMAL, cairo.FontWeight.BOLD)
+    cr.set_font_size(NUMBER_REFERENCE_FONT_SIZE)
+    xbearing, _, width, height, _, _ = cr.text_extents(text)
+    return (
+        xbearing / NUMBER_REFERENCE_FONT_SIZE,
+        width / NUMBER_REFERENCE_FONT_SIZE,
+        height / NUMBER_REFERENCE_FONT_SIZE
+    )
+
+
+@dataclass(frozen=True)
+class CoordTransform:
+    # Image to widget mapping, a per-axis scale plus offset.
+    # Built once per frame so the actions do not each call back into the
+    # overlay for every point they draw.
+    sx: float
+    sy: float
+    tx: float
+    ty: float
+
+    def apply_xy(self, x: float, y: float) -> tuple[float, float]:
+        return x * self.sx + self.tx, y * self.sy + self.ty
+
+    def apply_points(self, points: list[tuple[int, int]]) -> list[tuple[float, float]]:
+        sx, sy, tx, ty = self.sx, self.sy, self.tx, self.ty
+        return [(x * sx + tx, y * sy + ty) for x, y in points]
+
+
+def _simplify_points(points: list[tuple[int, int]], epsilon: float, max_length: float) -> list[tuple[int, int]]:
+    # Iterative Ramer-Douglas-Peucker, keeps the end points of the stroke.
+    # Spans longer than max_length are split anyway so the midpoint
+    # smoothing in StrokeAction does not visibly round off corners.
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    epsilon_sq = epsilon * epsilon
+    max_length_sq = max_length * max_length
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        x1, y1 = points[first]
+        x2, y2 = points[last]
+        dx = x2 - x1
+        dy = y2 - y1
+        length_sq = dx * dx + dy * dy
+        max_dist_sq = 0.0
+        index = first
+        for i in range(first + 1, last):
+            px, py = points[i]
+            # Distance to the segment, not the infinite line, so a stroke
+            # that doubles back keeps its turnaround point
+            if length_sq == 0:
+                t = 0.0
+            else:
+                t = max(0.0, min(1.0, ((px - x1) * dx + (py - y1) * dy) / length_sq))
+            dist_sq = (px - x1 - t * dx) ** 2 + (py - y1 - t * dy) ** 2
+            if dist_sq > max_dist_sq:
+                max_dist_sq = dist_sq
+                index = i
+        if max_dist_sq <= epsilon_sq and length_sq > max_length_sq and last - first > 1:
+            index = (first + last) // 2
+            max_dist_sq = math.inf
+        if max_dist_sq > epsilon_sq:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
 
 class DrawingMode(Enum):
     SELECT = "SELECT"
@@ -44,23 +143,28 @@ class DrawingMode(Enum):
     NUMBER = "NUMBER"
 
     def label(self):
-        return {
-            "PEN": _("Pen"),
-            "ARROW": _("Arrow"),
-            "LINE": _("Line"),
-            "SQUARE": _("Rectangle"),
-            "CIRCLE": _("Oval"),
-            "TEXT": _("Text"),
-            "SELECT": _("Select"),
-            "HIGHLIGHTER": _("Highlighter"),
-            "CENSOR": _("Censor"),
-            "NUMBER": _("Number"),
-        }[self.value]
+        # Built on first use rather than at import, so gettext is installed
+        if DrawingMode._labels is None:
+            DrawingMode._labels = {
+                "PEN": _("Pen"),
+                "ARROW": _("Arrow"),
+                "LINE": _("Line"),
+                "SQUARE": _("Rectangle"),
+                "CIRCLE": _("Oval"),
+                "TEXT": _("Text"),
+                "SELECT": _("Select"),
+                "HIGHLIGHTER": _("Highlighter"),
+                "CENSOR": _("Censor"),
+                "NUMBER": _("Number"),
+            }
+        return DrawingMode._labels[self.value]
 
     @property
     def shortcuts(self):
         return DrawingMode._shortcuts[self]
 
+DrawingMode._labels = None
+
 DrawingMode._shortcuts = {
     DrawingMode.SELECT:       ["0", "KP_0", "grave", "s"],
     DrawingMode.PEN:          ["1", "KP_1", "d", "p"],
@@ -81,15 +185,18 @@ class QuadBounds:
         self.p2 = p2
         self.p3 = p3
         self.p4 = p4
+        self._bounding_rect = None
 
     @classmethod
     def from_rect(cls, min_x: float, min_y: float, max_x: float, max_y: float):
-        return cls(
+        bounds = cls(
             (min_x, min_y),
             (max_x, min_y),
             (max_x, max_y),
             (min_x, max_y)
         )
+        bounds._bounding_rect = (min_x, min_y, max_x, max_y)
+        return bounds
 
     @classmethod
     def from_start_end(cls, start: tuple[float, float], end: tuple[float, float]):
@@ -102,35 +209,82 @@ class QuadBounds:
     def get_points(self) -> list[tuple[float, float]]:
         return [self.p1, self.p2, self.p3, self.p4]
 
+    def translated(self, dx: float, dy: float) -> "QuadBounds":
+        bounds = QuadBounds(
+            (self.p1[0] + dx, self.p1[1] + dy),
+            (self.p2[0] + dx, self.p2[1] + dy),
+            (self.p3[0] + dx, self.p3[1] + dy),
+            (self.p4[0] + dx, self.p4[1] + dy)
+        )
+        if self._bounding_rect is not None:
+            min_x, min_y, max_x, max_y = self._bounding_rect
+            bounds._bounding_rect = (min_x + dx, min_y + dy, max_x + dx, max_y + dy)
+        return bounds
+
     def get_bounding_rect(self) -> tuple[float, float, float, float]:
-        points = self.get_points()
-        xs = [p[0] for p in points]
-        ys = [p[1] for p in points]
-        return min(xs), min(ys), max(xs), max(ys)
+        if self._bounding_rect is None:
+            points = self.get_points()
+            xs = [p[0] for p in points]
+            ys = [p[1] for p in points]
+            self._bounding_rect = (min(xs), min(ys), max(xs), max(ys))
+        return self._bounding_rect
 
 
 class DrawingAction:
-    def draw(self, cr: cairo.Context, image_to_widget_coords: Callable[[int, int], tuple[float, float]], scale: float):
+    __slots__ = ('options', '_bounds_cache', '_bounds_key')
+
+    # Export may already run on a non-main thread (clipboard copy, export on
+    # close) while _on_draw uses the same actions, so every draw() has to
+    # tolerate a concurrent draw of the same action. PARALLEL_SAFE further
+    # marks actions that only build Cairo paths from their own state and can
+    # be drawn by several tile workers at once. Actions sharing layouts,
+    # patterns or source surfaces between draws must leave this False.
+    PARALLEL_SAFE = False
+
+    def __init__(self):
+        self._bounds_cache: QuadBounds | None = None
+        self._bounds_key: tuple | None = None
+
+    def draw(self, cr: cairo.Context, transform: CoordTransform, scale: float):
+        raise NotImplementedError
+
+    def get_batch_key(self) -> tuple | None:
+        # Actions returning the same key can share their Cairo state and be
+        # stroked as one path, see draw_actions()
+        return None
+
+    def append_batch_path(self, cr: cairo.Context, transform: CoordTransform):
         raise NotImplementedError
 
     def get_bounds(self) -> QuadBounds:
+        key = self._get_bounds_key()
+        if self._bounds_cache is None or key != self._bounds_key:
+            self._bounds_cache = self._compute_bounds()
+            self._bounds_key = key
+        return self._bounds_cache
+
+    def _compute_bounds(self) -> QuadBounds:
         raise NotImplementedError
 
+    def _get_bounds_key(self) -> tuple:
+        # Everything the bounds depend on that can change after creation.
+        # Options are edited in place, so their revision is part of the key.
+        raise NotImplementedError
+
+    def _get_valid_bounds_cache(self) -> QuadBounds | None:
+        if self._bounds_cache is not None and self._bounds_key == self._get_bounds_key():
+            return self._bounds_cache
+        return None
+
+    def _set_translated_bounds(self, bounds: QuadBounds | None, dx: int, dy: int):
+        if bounds is None:
+            self._bounds_cache = None
+            return
+        self._bounds_cache = bounds.translated(dx, dy)
+        self._bounds_key = self._get_bounds_key()
+
     def contains_point(self, x_img: int, y_img: int) -> bool:
         min_x, min_y, max_x, max_y = self.get_bounds().get_bounding_rect()
-        if isinstance(self, (LineAction, ArrowAction)):
-            px, py = x_img, y_img
-            x1, y1 = self.start
-            x2, y2 = self.end
-            line_len_sq = (x2 - x1) ** 2 + (y2 - y1) ** 2
-            if line_len_sq == 0:
-                return math.hypot(px - x1, py - y1) < (5 + self.options.size * 1.75)
-            t = ((px - x1) * (x2 - x1) + (py - y1) * (y2 - y1)) / line_len_sq
-            t = max(0, min(1, t))
-            closest_x = x1 + t * (x2 - x1)
-            closest_y = y1 + t * (y2 - y1)
-            dist_sq = (px - closest_x)**2 + (py - closest_y)**2
-            return dist_sq < (5 + self.options.size * 1.75)**2
         return min_x <= x_img <= max_x and min_y <= y_img <= max_y
 
     def _calculate_shadow_color(self, color):
@@ -151,56 +305,109 @@ class DrawingAction:
 
 
 class StrokeAction(DrawingAction):
+    __slots__ = ('stroke',)
+
+    PARALLEL_SAFE = True
+    POLYLINE_MAX_SEGMENT = 1.5
+    FLAT_CROSS_TOLERANCE = 0.5
+
     def __init__(self, stroke: list[tuple[int, int]], options):
+        super().__init__()
         self.stroke = stroke
         self.options = options
-        self._bounds = None
 
-    def draw(self, cr: cairo.Context, image_to_widget_coords: Callable[[int, int], tuple[float, float]], scale: float):
+    def draw(self, cr: cairo.Context, transform: CoordTransform, scale: float):
         if len(self.stroke) < 2:
             return
-        coords = [image_to_widget_coords(x, y) for x, y in self.stroke]
+        coords = transform.apply_points(self.stroke)
         line_width = self.options.size * scale
         self._build_path(cr, coords)
-        cr.set_source_rgba(*self.options.primary_color)
+        cr.set_source_rgba(*self.options.primary_rgba)
         cr.set_line_width(line_width)
         cr.stroke()
 
+    def get_batch_key(self) -> tuple | None:
+        color = self.options.primary_rgba
+        # Overlapping translucent strokes must still blend separately
+        if color[3] < 1.0:
+            return None
+        return (color, self.options.size)
+
+    def append_batch_path(self, cr: cairo.Context, transform: CoordTransform):
+        if len(self.stroke) < 2:
+            return
+        self._append_path(cr, transform.apply_points(self.stroke))
+
     def _build_path(self, cr, coords):
         cr.set_line_cap(cairo.LineCap.ROUND)
         cr.set_line_join(cairo.LineJoin.ROUND)
+        self._append_path(cr, coords)
+
+    def _append_path(self, cr, coords):
         if len(coords) <= 2:
             cr.move_to(*coords[0])
             if len(coords) == 2:
                 cr.line_to(*coords[1])
             return
+        if self._is_flat(coords):
+            line_to = cr.line_to
+            cr.move_to(*coords[0])
+            for point in coords[1:]:
+                line_to(*point)
+            return
+        curve_to = cr.curve_to
         cr.move_to(*coords[0])
-        for i in range(1, len(coords) - 1):
-            x1, y1 = coords[i]
-            x2, y2 = coords[i + 1]
-            mid_x = (x1 + x2) * 0.5
-            mid_y = (y1 + y2) * 0.5
-            cr.curve_to(x1, y1, x1, y1, mid_x, mid_y)
+        for (x1, y1), (x2, y2) in zip(coords[1:-1], coords[2:]):
+            curve_to(x1, y1, x1, y1, (x1 + x2) * 0.5, (y1 + y2) * 0.5)
         cr.line_to(*coords[-1])
 
-    def get_bounds(self) -> QuadBounds:
-        if self._bounds is None:
-            if not self.stroke:
-                self._bounds = QuadBounds.from_rect(0, 0, 0, 0)
-            else:
-                xs, ys = zip(*self.stroke)
-                padding = self.options.size // 2
-                self._bounds = QuadBounds.from_rect(
-                    min(xs) - padding,
-                    min(ys) - padding,
-                    max(xs) + padding,
-                    max(ys) + padding
-                )
-        return self._bounds
+    def _is_flat(self, coords) -> bool:
+        # Smoothing is invisible when every segment is sub-pixel or when
+        # consecutive segments are (nearly) colinear and keep their direction
+        max_segment_sq = self.POLYLINE_MAX_SEGMENT ** 2
+        short = True
+        straight = True
+        prev_dx, prev_dy = coords[1][0] - coords[0][0], coords[1][1] - coords[0][1]
+        if prev_dx * prev_dx + prev_dy * prev_dy >= max_segment_sq:
+            short = False
+        for (x1, y1), (x2, y2) in zip(coords[1:-1], coords[2:]):
+            dx = x2 - x1
+            dy = y2 - y1
+            if short and dx * dx + dy * dy >= max_segment_sq:
+                short = False
+            # A reversal has a zero cross product too, so the segments must
+            # also point the same way to count as colinear
+            if straight and (abs(prev_dx * dy - prev_dy * dx) >= self.FLAT_CROSS_TOLERANCE or
+                             prev_dx * dx + prev_dy * dy <= 0):
+                straight = False
+            if not short and not straight:
+                return False
+            prev_dx, prev_dy = dx, dy
+        return True
+
+    def _compute_bounds(self) -> QuadBounds:
+        if not self.stroke:
+            return QuadBounds.from_rect(0, 0, 0, 0)
+        xs, ys = zip(*self.stroke)
+        padding = self.options.size // 2
+        return QuadBounds.from_rect(
+            min(xs) - padding,
+            min(ys) - padding,
+            max(xs) + padding,
+            max(ys) + padding
+        )
+
+    def _get_bounds_key(self) -> tuple:
+        return (len(self.stroke), self.options.revision)
+
+    def finalize(self):
+        self.stroke = _simplify_points(self.stroke, self.options.size / 4, self.options.size * 2)
+        self._bounds_cache = None
 
     def translate(self, dx: int, dy: int):
+        bounds = self._get_valid_bounds_cache()
         self.stroke = [(x + dx, y + dy) for x, y in self.stroke]
-        self._bounds = None
+        self._set_translated_bounds(bounds, dx, dy)
 
 
 class ArrowAction(DrawingAction):
@@ -210,8 +417,17 @@ class ArrowAction(DrawingAction):
     SHAFT_START_WIDTH_RATIO = 0.35
     MAX_HEAD_LENGTH_RATIO = 0.6
     MIN_DISTANCE_THRESHOLD = 2
+    # Control point distance for a quarter circle drawn as one cubic Bezier
+    ARC_KAPPA = 0.5522847498
+
+    __slots__ = ('start', 'end', '_hit_segment', '_hit_segment_key')
+
+    PARALLEL_SAFE = True
 
     def __init__(self, start: tuple[int, int], end: tuple[int, int], shift: bool, options):
+        super().__init__()
+        self._hit_segment: tuple[float, float, float, float, float, float] | None = None
+        self._hit_segment_key: tuple | None = None
         self.options = options
         self.start = start
         if shift:
@@ -224,9 +440,9 @@ class ArrowAction(DrawingAction):
         else:
             self.end = end
 
-    def draw(self, cr: cairo.Context, image_to_widget_coords: Callable[[int, int], tuple[float, float]], scale: float):
-        start_x, start_y = image_to_widget_coords(*self.start)
-        end_x, end_y = image_to_widget_coords(*self.end)
+    def draw(self, cr: cairo.Context, transform: CoordTransform, scale: float):
+        start_x, start_y = transform.apply_xy(*self.start)
+        end_x, end_y = transform.apply_xy(*self.end)
         distance = math.hypot(end_x - start_x, end_y - start_y)
         if distance < self.MIN_DISTANCE_THRESHOLD:
             return
@@ -234,13 +450,12 @@ class ArrowAction(DrawingAction):
         width = self.options.size * 1.75
         arrow_head_size = self.options.size * self.ARROW_HEAD_SIZE_MULTIPLIER * 1.75
 
-        angle = math.atan2(end_y - start_y, end_x - start_x)
-        cos_a = math.cos(angle)
-        sin_a = math.sin(angle)
+        cos_a = (end_x - start_x) / distance
+        sin_a = (end_y - start_y) / distance
         start_offset = width * scale / 2
         adjusted_start_x = start_x + start_offset * cos_a
         adjusted_start_y = start_y + start_offset * sin_a
-        adjusted_distance = math.hypot(end_x - adjusted_start_x, end_y - adjusted_start_y)
+        adjusted_distance = abs(distance - start_offset)
         if adjusted_distance < self.MIN_DISTANCE_THRESHOLD:
             return
 
@@ -257,18 +472,36 @@ class ArrowAction(DrawingAction):
 
         self._build_arrow_path(
             cr, adjusted_start_x, adjusted_start_y, shaft_end_x, shaft_end_y,
-            end_x, end_y, angle, shaft_start_half, shaft_end_half,
+            end_x, end_y, shaft_start_half, shaft_end_half,
             head_half, perp_cos, perp_sin
         )
 
-        cr.set_source_rgba(*self.options.primary_color)
+        cr.set_source_rgba(*self.options.primary_rgba)
         cr.fill()
 
     def _build_arrow_path(self, cr, start_x, start_y, shaft_end_x, shaft_end_y,
-                         end_x, end_y, angle, shaft_start_half, shaft_end_half,
+                         end_x, end_y, shaft_start_half, shaft_end_half,
                          head_half, perp_cos, perp_sin):
-        cr.move_to(start_x + shaft_start_half * perp_cos, start_y + shaft_start_half * perp_sin)
-        cr.arc(start_x, start_y, shaft_start_half, angle + math.pi/2, angle - math.pi/2)
+        # Rounded tail: a half circle behind the start point, as two quarter
+        # arcs built from the direction vectors instead of angles
+        r = shaft_start_half
+        k = r * self.ARC_KAPPA
+        # Unit vector along the arrow (perp rotated back by -90 degrees)
+        dir_cos = perp_sin
+        dir_sin = -perp_cos
+        back_x = start_x - r * dir_cos
+        back_y = start_y - r * dir_sin
+        cr.move_to(start_x + r * perp_cos, start_y + r * perp_sin)
+        cr.curve_to(
+            start_x + r * perp_cos - k * dir_cos, start_y + r * perp_sin - k * dir_sin,
+            back_x + k * perp_cos, back_y + k * perp_sin,
+            back_x, back_y
+        )
+        cr.curve_to(
+            back_x - k * perp_cos, back_y - k * perp_sin,
+            start_x - r * perp_cos - k * dir_cos, start_y - r * perp_sin - k * dir_sin,
+            start_x - r * perp_cos, start_y - r * perp_sin
+        )
         cr.line_to(shaft_end_x - shaft_end_half * perp_cos, shaft_end_y - shaft_end_half * perp_sin)
         cr.line_to(shaft_end_x - head_half * perp_cos, shaft_end_y - head_half * perp_sin)
         cr.line_to(end_x, end_y)
@@ -276,21 +509,17 @@ class ArrowAction(DrawingAction):
         cr.line_to(shaft_end_x + shaft_end_half * perp_cos, shaft_end_y + shaft_end_half * perp_sin)
         cr.close_path()
 
-    def get_bounds(self) -> QuadBounds:
+    def _compute_bounds(self) -> QuadBounds:
         distance = math.hypot(self.end[0] - self.start[0], self.end[1] - self.start[1])
         if distance < self.MIN_DISTANCE_THRESHOLD:
             return QuadBounds.from_rect(self.start[0], self.start[1], self.start[0], self.start[1])
 
-        angle = math.atan2(self.end[1] - self.start[1], self.end[0] - self.start[0])
-
         arrow_head_size = self.options.size * self.ARROW_HEAD_SIZE_MULTIPLIER * 1.75
         head_len = min(arrow_head_size, distance * self.MAX_HEAD_LENGTH_RATIO)
         head_width = head_len * self.HEAD_WIDTH_RATIO
 
-        cos_angle = math.cos(angle)
-        sin_angle = math.sin(angle)
-        perp_cos = -sin_angle
-        perp_sin = cos_angle
+        perp_cos = -(self.end[1] - self.start[1]) / distance
+        perp_sin = (self.end[0] - self.start[0]) / distance
 
         start_x, start_y = self.start
         end_x, end_y = self.end
@@ -302,16 +531,51 @@ class ArrowAction(DrawingAction):
 
         return QuadBounds(p1, p2, p3, p4)
 
+    def _get_bounds_key(self) -> tuple:
+        return (self.start, self.end, self.options.revision)
+
+    def _get_hit_segment(self) -> tuple[float, float, float, float, float, float]:
+        key = self._get_bounds_key()
+        if self._hit_segment is None or key != self._hit_segment_key:
+            x1, y1 = self.start
+            dx = self.end[0] - x1
+            dy = self.end[1] - y1
+            length_sq = dx * dx + dy * dy
+            inv_length_sq = 1.0 / length_sq if length_sq else 0.0
+            radius = 5 + self.options.size * 1.75
+            self._hit_segment = (x1, y1, dx, dy, inv_length_sq, radius * radius)
+            self._hit_segment_key = key
+        return self._hit_segment
+
+    def contains_point(self, x_img: int, y_img: int) -> bool:
+        x1, y1, dx, dy, inv_length_sq, radius_sq = self._get_hit_segment()
+        px = x_img - x1
+        py = y_img - y1
+        t = (px * dx + py * dy) * inv_length_sq
+        if t < 0.0:
+            t = 0.0
+        elif t > 1.0:
+            t = 1.0
+        ex = px - t * dx
+        ey = py - t * dy
+        return ex * ex + ey * ey < radius_sq
+
     def translate(self, dx: int, dy: int):
+        bounds = self._get_valid_bounds_cache()
         self.start = (self.start[0] + dx, self.start[1] + dy)
         self.end = (self.end[0] + dx, self.end[1] + dy)
+        self._set_translated_bounds(bounds, dx, dy)
 
 
 class TextAction(DrawingAction):
+    __slots__ = ('position', 'text', 'intrinsic_image_bounds', 'font_size', '_layout_cache')
+
     PADDING_X_IMG = 4
     PADDING_Y_IMG = 2
 
     def __init__(self, position: tuple[int, int], text: str, intrinsic_image_bounds: tuple[int, int], options, font_size):
+        super().__init__()
+        self._layout_cache: tuple[tuple, Pango.Layout, list[tuple[float, float]]] | None = None
         self.options = options
         self.position = position
         self.text = text
@@ -345,7 +609,7 @@ class TextAction(DrawingAction):
 
         cr.close_path()
 
-    def draw_per_line_background(self, cr: cairo.Context, layout, text_x_widget: float, text_y_widget: float, scale: float):
+    def draw_per_line_background(self, cr: cairo.Context, layout, line_sizes: list[tuple[float, float]], text_x_widget: float, text_y_widget: float, scale: float):
         lines = self.text.split('\n')
         if len(lines) <= 1:
             _, logical_rect = layout.get_extents()
@@ -362,24 +626,11 @@ class TextAction(DrawingAction):
             cr.fill()
             return
 
-        line_heights = []
-        line_widths = []
-
         _, overall_logical_rect = layout.get_extents()
         overall_width = overall_logical_rect.width / Pango.SCALE
 
-        for line in lines:
-            temp_layout = PangoCairo.create_layout(cr)
-            font_desc = Pango.FontDescription()
-            font_desc.set_family(self.options.font)
-            font_desc.set_size(int(self.font_size * scale * Pango.SCALE))
-            temp_layout.set_font_description(font_desc)
-            temp_layout.set_text(line, -1)
-            temp_layout.set_alignment(Pango.Alignment.CENTER)
-
-            _, logical_rect = temp_layout.get_extents()
-            line_widths.append(logical_rect.width / Pango.SCALE)
-            line_heights.append(logical_rect.height / Pango.SCALE)
+        line_widths = [width for width, _ in line_sizes]
+        line_heights = [height for _, height in line_sizes]
 
         current_y = text_y_widget
 
@@ -404,19 +655,51 @@ class TextAction(DrawingAction):
 
             current_y += line_height
 
-    def draw(self, cr: cairo.Context, image_to_widget_coords: Callable[[int, int], tuple[float, float]], scale: float):
-        if not self.text.strip():
-            return
-
-        x_widget, y_widget = image_to_widget_coords(*self.position)
-
+    def _create_layout(self, cr: cairo.Context, font_size: int) -> tuple[Pango.Layout, list[tuple[float, float]]]:
         layout = PangoCairo.create_layout(cr)
+        layout.set_alignment(Pango.Alignment.CENTER)
         font_desc = Pango.FontDescription()
         font_desc.set_family(self.options.font)
-        font_desc.set_size(int(self.font_size * scale * Pango.SCALE))
+        font_desc.set_size(font_size)
         layout.set_font_description(font_desc)
+
+        line_sizes = []
+        lines = self.text.split('\n')
+        if len(lines) > 1:
+            for line in lines:
+                layout.set_text(line, -1)
+                _, logical_rect = layout.get_extents()
+                line_sizes.append((logical_rect.width / Pango.SCALE, logical_rect.height / Pango.SCALE))
+
         layout.set_text(self.text, -1)
-        layout.set_alignment(Pango.Alignment.CENTER)
+        return layout, line_sizes
+
+    def _get_layout(self, cr: cairo.Context, scale: float) -> tuple[Pango.Layout, list[tuple[float, float]]]:
+        # The canvas reuses the layout between frames and only reshapes it
+        # when the text or the effective font size changes. Export may run on
+        # a worker thread while the canvas is drawn, so it builds its own.
+        font_size = int(self.font_size * scale * Pango.SCALE)
+        if threading.current_thread() is not threading.main_thread():
+            return self._create_layout(cr, font_size)
+
+        key = (self.text, self.options.font, font_size)
+        cache = self._layout_cache
+        if cache is not None and cache[0] == key:
+            _, layout, line_sizes = cache
+            PangoCairo.update_layout(cr, layout)
+            return layout, line_sizes
+
+        layout, line_sizes = self._create_layout(cr, font_size)
+        self._layout_cache = (key, layout, line_sizes)
+        return layout, line_sizes
+
+    def draw(self, cr: cairo.Context, transform: CoordTransform, scale: float):
+        if not self.text.strip():
+            return
+
+        x_widget, y_widget = transform.apply_xy(*self.position)
+
+        layout, line_sizes = self._get_layout(cr, scale)
 
         _, logical_rect = layout.get_extents()
         text_width_widget = logical_rect.width / Pango.SCALE
@@ -425,48 +708,36 @@ class TextAction(DrawingAction):
         text_x_widget = x_widget - text_width_widget / 2
         text_y_widget = y_widget - text_height_widget
 
-        if self.options.fill_color and any(c > 0 for c in self.options.fill_color):
-            cr.set_source_rgba(*self.options.fill_color)
-            self.draw_per_line_background(cr, layout, text_x_widget, text_y_widget, scale)
+        if any(c > 0 for c in self.options.fill_rgba):
+            cr.set_source_rgba(*self.options.fill_rgba)
+            self.draw_per_line_background(cr, layout, line_sizes, text_x_widget, text_y_widget, scale)
 
         cr.move_to(text_x_widget, text_y_widget)
         if self.contains_emoji():
-            cr.set_source_rgba(*self.options.primary_color)
+            cr.set_source_rgba(*self.options.primary_rgba)
             PangoCairo.show_layout(cr, layout)
         else:
             PangoCairo.layout_path(cr, layout)
-            if self.options.border_color and any(c > 0 for c in self.options.border_color):
-                cr.set_source_rgba(*self.options.border_color)
+            if any(c > 0 for c in self.options.border_rgba):
+                cr.set_source_rgba(*self.options.border_rgba)
                 base_line_width = 2.0
                 adjusted_line_width = base_line_width * scale * (self.font_size / 14.0)
                 cr.set_line_width(adjusted_line_width)
                 cr.stroke_preserve()
-            cr.set_source_rgba(*self.options.primary_color)
+            cr.set_source_rgba(*self.options.primary_rgba)
             cr.fill()
 
-    def get_bounds(self) -> QuadBounds:
+    def _compute_bounds(self) -> QuadBounds:
         if not self.text.strip():
             x, y = self.position
             return QuadBounds.from_rect(x, y, x, y)
 
-        temp_surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1)
-        temp_cr = cairo.Context(temp_surface)
-        layout = PangoCairo.create_layout(temp_cr)
-        font_desc = Pango.FontDescription()
-        font_desc.set_family(self.options.font)
-        font_desc.set_size(int(self.font_size * Pango.SCALE))
-        layout.set_font_description(font_desc)
-        layout.set_text(self.text, -1)
-        layout.set_alignment(Pango.Alignment.CENTER)
-
-        _, logical_rect = layout.get_extents()
-        text_width_img = int(logical_rect.width / Pango.SCALE)
-        text_height_img = int(logical_rect.height / Pango.SCALE)
+        text_width_img, text_height_img = _get_text_extents(self.text, self.options.font, self.font_size)
 
         x_img, y_img = self.position
 
         outline_padding = 0
-        if self.options.border_color and any(c > 0 for c in self.options.border_color):
+        if any(c > 0 for c in self.options.border_rgba):
             outline_padding = int(2.0 * (self.font_size / 14.0)) + 1
 
         left_img = x_img - text_width_img // 2 - self.PADDING_X_IMG - outline_padding
@@ -476,39 +747,50 @@ class TextAction(DrawingAction):
 
         return QuadBounds.from_rect(left_img, top_img, right_img, bottom_img)
 
+    def _get_bounds_key(self) -> tuple:
+        return (self.position, self.text, self.font_size, self.options.revision)
+
     def translate(self, dx: int, dy: int):
+        bounds = self._get_valid_bounds_cache()
         self.position = (self.position[0] + dx, self.position[1] + dy)
+        self._set_translated_bounds(bounds, dx, dy)
 
 
 class LineAction(ArrowAction):
-    def draw(self, cr: cairo.Context, image_to_widget_coords: Callable[[int, int], tuple[float, float]], scale: float):
-        start_x, start_y = image_to_widget_coords(*self.start)
-        end_x, end_y = image_to_widget_coords(*self.end)
+    __slots__ = ()
+
+    def draw(self, cr: cairo.Context, transform: CoordTransform, scale: float):
+        start_x, start_y = transform.apply_xy(*self.start)
+        end_x, end_y = transform.apply_xy(*self.end)
 
         width = self.options.size * 1.75
-        angle = math.atan2(end_y - start_y, end_x - start_x)
+        cos_a, sin_a = self._get_direction(end_x - start_x, end_y - start_y)
         half_width = (width * scale) / 2
 
-        start_x += half_width * math.cos(angle)
-        start_y += half_width * math.sin(angle)
-        end_x -= half_width * math.cos(angle)
-        end_y -= half_width * math.sin(angle)
+        start_x += half_width * cos_a
+        start_y += half_width * sin_a
+        end_x -= half_width * cos_a
+        end_y -= half_width * sin_a
 
         line_width = width * scale
         cr.set_line_width(line_width)
         cr.move_to(start_x, start_y)
         cr.line_to(end_x, end_y)
-        cr.set_source_rgba(*self.options.primary_color)
+        cr.set_source_rgba(*self.options.primary_rgba)
         cr.stroke()
 
-    def get_bounds(self) -> QuadBounds:
-        angle = math.atan2(self.end[1] - self.start[1], self.end[0] - self.start[0])
+    def _get_direction(self, dx: float, dy: float) -> tuple[float, float]:
+        length = math.hypot(dx, dy)
+        if length == 0:
+            return 1.0, 0.0
+        return dx / length, dy / length
+
+    def _compute_bounds(self) -> QuadBounds:
+        cos_angle, sin_angle = self._get_direction(self.end[0] - self.start[0], self.end[1] - self.start[1])
 
         width = self.options.size * 1.75
         half_width = width / 2
 
-        cos_angle = math.cos(angle)
-        sin_angle = math.sin(angle)
         perp_cos = -sin_angle
         perp_sin = cos_angle
 
@@ -524,15 +806,20 @@ class LineAction(ArrowAction):
 
 
 class RectAction(DrawingAction):
+    __slots__ = ('start', 'end', 'shift')
+
+    PARALLEL_SAFE = True
+
     def __init__(self, start: tuple[int, int], end: tuple[int, int], shift: bool, options):
+        super().__init__()
         self.options = options
         self.start = start
         self.end = end
         self.shift = shift
 
-    def draw(self, cr: cairo.Context, image_to_widget_coords: Callable[[int, int], tuple[float, float]], scale: float):
-        x1_widget, y1_widget = image_to_widget_coords(*self.start)
-        x2_widget, y2_widget = image_to_widget_coords(*self.end)
+    def draw(self, cr: cairo.Context, transform: CoordTransform, scale: float):
+        x1_widget, y1_widget = transform.apply_xy(*self.start)
+        x2_widget, y2_widget = transform.apply_xy(*self.end)
 
         if self.shift:
             size = max(abs(x2_widget - x1_widget), abs(y2_widget - y1_widget))
@@ -552,16 +839,16 @@ class RectAction(DrawingAction):
         h = abs(y2_widget - y1_widget) - (self.options.size * scale)
 
         if w > 0 and h > 0:
-            if self.options.fill_color:
-                cr.set_source_rgba(*self.options.fill_color)
+            if self.options.fill_rgba:
+                cr.set_source_rgba(*self.options.fill_rgba)
                 cr.rectangle(x, y, w, h)
                 cr.fill()
-            cr.set_source_rgba(*self.options.primary_color)
+            cr.set_source_rgba(*self.options.primary_rgba)
             cr.set_line_width(self.options.size * scale)
             cr.rectangle(x, y, w, h)
             cr.stroke()
 
-    def get_bounds(self) -> QuadBounds:
+    def _compute_bounds(self) -> QuadBounds:
         if self.shift:
             dx = abs(self.end[0] - self.start[0])
             dy = abs(self.end[1] - self.start[1])
@@ -578,15 +865,22 @@ class RectAction(DrawingAction):
         else:
             return QuadBounds.from_start_end(self.start, self.end)
 
+    def _get_bounds_key(self) -> tuple:
+        return (self.start, self.end, self.shift, self.options.revision)
+
     def translate(self, dx: int, dy: int):
+        bounds = self._get_valid_bounds_cache()
         self.start = (self.start[0] + dx, self.start[1] + dy)
         self.end = (self.end[0] + dx, self.end[1] + dy)
+        self._set_translated_bounds(bounds, dx, dy)
 
 
 class CircleAction(RectAction):
-    def draw(self, cr: cairo.Context, image_to_widget_coords: Callable[[int, int], tuple[float, float]], scale: float):
-        x1_widget, y1_widget = image_to_widget_coords(*self.start)
-        x2_widget, y2_widget = image_to_widget_coords(*self.end)
+    __slots__ = ()
+
+    def draw(self, cr: cairo.Context, transform: CoordTransform, scale: float):
+        x1_widget, y1_widget = transform.apply_xy(*self.start)
+        x2_widget, y2_widget = transform.apply_xy(*self.end)
 
         if self.shift:
             size = max(abs(x2_widget - x1_widget), abs(y2_widget - y1_widget))
@@ -611,30 +905,30 @@ class CircleAction(RectAction):
             cr.arc(0, 0, 1, 0, 2 * math.pi)
             cr.restore()
 
-            if self.options.fill_color:
-                cr.set_source_rgba(*self.options.fill_color)
+            if self.options.fill_rgba:
+                cr.set_source_rgba(*self.options.fill_rgba)
                 cr.fill_preserve()
-            cr.set_source_rgba(*self.options.primary_color)
+            cr.set_source_rgba(*self.options.primary_rgba)
             cr.set_line_width(self.options.size * scale)
             cr.stroke()
 
 
 class HighlighterAction(StrokeAction):
+    __slots__ = ()
+
     def __init__(self, stroke: list[tuple[int, int]], options, shift: bool):
         if shift and len(stroke) >= 2:
             start_point = stroke[0]
             end_point = stroke[-1]
-            self.stroke = [start_point, (end_point[0], start_point[1])]
-        else:
-            self.stroke = stroke
-        self.options = options
+            stroke = [start_point, (end_point[0], start_point[1])]
+        super().__init__(stroke, options)
 
-    def draw(self, cr: cairo.Context, image_to_widget_coords: Callable[[int, int], tuple[float, float]], scale: float):
+    def draw(self, cr: cairo.Context, transform: CoordTransform, scale: float):
         if len(self.stroke) < 2:
             return
-        coords = [image_to_widget_coords(x, y) for x, y in self.stroke]
+        coords = transform.apply_points(self.stroke)
         cr.set_operator(cairo.Operator.MULTIPLY)
-        cr.set_source_rgba(*self.options.primary_color)
+        cr.set_source_rgba(*self.options.primary_rgba)
         cr.set_line_width(self.options.size * scale * 2)
         cr.set_line_cap(cairo.LineCap.BUTT)
         cr.move_to(*coords[0])
@@ -644,7 +938,11 @@ class HighlighterAction(StrokeAction):
         cr.set_operator(cairo.Operator.OVER)
         cr.set_line_cap(cairo.LineCap.ROUND)
 
-    def get_bounds(self) -> QuadBounds:
+    def get_batch_key(self) -> tuple | None:
+        # Overlapping highlights have to multiply twice, never merge them
+        return None
+
+    def _compute_bounds(self) -> QuadBounds:
         if not self.stroke:
             return QuadBounds.from_rect(0, 0, 0, 0)
         xs, ys = zip(*self.stroke)
@@ -653,12 +951,17 @@ class HighlighterAction(StrokeAction):
 
 
 class CensorAction(RectAction):
-    def __init__(self, start: tuple[int, int], end: tuple[int, int], background_pixbuf: GdkPixbuf.Pixbuf, options):
+    __slots__ = ('original_scale', 'base_block_size', 'background_surface', '_pixelated_cache')
+
+    PARALLEL_SAFE = False
+
+    def __init__(self, start: tuple[int, int], end: tuple[int, int], background_surface: cairo.ImageSurface, options):
         super().__init__(start, end, False, options)
+        self._pixelated_cache: tuple[tuple, cairo.SurfacePattern] | None = None
 
         self.original_scale = 1.0
         self.base_block_size = 8
-        self.background_pixbuf = background_pixbuf
+        self.background_surface = background_surface
 
     def set_original_scale(self, scale: float):
         self.original_scale = scale
@@ -667,9 +970,9 @@ class CensorAction(RectAction):
         scale_ratio = current_scale / self.original_scale
         return self.base_block_size * scale_ratio
 
-    def draw(self, cr: cairo.Context, image_to_widget_coords: Callable[[int, int], tuple[float, float]], scale: float):
-        x1, y1 = image_to_widget_coords(*self.start)
-        x2, y2 = image_to_widget_coords(*self.end)
+    def draw(self, cr: cairo.Context, transform: CoordTransform, scale: float):
+        x1, y1 = transform.apply_xy(*self.start)
+        x2, y2 = transform.apply_xy(*self.end)
         x, y = min(x1, x2), min(y1, y2)
         width, height = abs(x2 - x1), abs(y2 - y1)
         if width < 1 or height < 1:
@@ -689,29 +992,38 @@ class CensorAction(RectAction):
         blocks_x = max(1, int(width / block_size))
         blocks_y = max(1, int(height / block_size))
 
-        tiny_surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, blocks_x, blocks_y)
-        tiny_cr = cairo.Context(tiny_surface)
-
-        tiny_cr.set_operator(cairo.OPERATOR_CLEAR)
-        tiny_cr.paint()
-        tiny_cr.set_operator(cairo.OPERATOR_OVER)
-
-        tiny_cr.scale(blocks_x / crop['width'], blocks_y / crop['height'])
-        tiny_cr.translate(-crop['x'], -crop['y'])
-        Gdk.cairo_set_source_pixbuf(tiny_cr, self.background_pixbuf, 0, 0)
-        tiny_cr.paint()
-
         cr.translate(x, y)
         cr.scale(width / blocks_x, height / blocks_y)
-        pattern = cairo.SurfacePattern(tiny_surface)
-        pattern.set_filter(cairo.FILTER_NEAREST)
-        cr.set_source(pattern)
+        cr.set_source(self._get_pixelated_pattern(crop, blocks_x, blocks_y))
         cr.paint()
 
         cr.restore()
 
+    def _get_pixelated_pattern(self, crop: dict, blocks_x: int, blocks_y: int) -> cairo.SurfacePattern:
+        # The block grid only depends on the crop, not on the zoom level,
+        # so the downsampled image is kept until the action is moved or resized
+        # The key and pattern are stored together so a draw from another
+        # thread never pairs a new key with an old block grid
+        key = (crop['x'], crop['y'], crop['width'], crop['height'], blocks_x, blocks_y)
+        cache = self._pixelated_cache
+        if cache is None or cache[0] != key:
+            # New image surfaces are zero-initialized, so no clear pass is needed
+            tiny_surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, blocks_x, blocks_y)
+            tiny_cr = cairo.Context(tiny_surface)
+
+            tiny_cr.scale(blocks_x / crop['width'], blocks_y / crop['height'])
+            tiny_cr.translate(-crop['x'], -crop['y'])
+            tiny_cr.set_source_surface(self.background_surface, 0, 0)
+            tiny_cr.paint()
+
+            pattern = cairo.SurfacePattern(tiny_surface)
+            pattern.set_filter(cairo.FILTER_NEAREST)
+            cache = (key, pattern)
+            self._pixelated_cache = cache
+        return cache[1]
+
     def _get_image_crop(self) -> dict | None:
-        img_w, img_h = self.background_pixbuf.get_width(), self.background_pixbuf.get_height()
+        img_w, img_h = self.background_surface.get_width(), self.background_surface.get_height()
         x1 = int(self.start[0] + img_w / 2)
         y1 = int(self.start[1] + img_h / 2)
         x2 = int(self.end[0] + img_w / 2)
@@ -721,11 +1033,13 @@ class CensorAction(RectAction):
         width, height = x_end - x_start, y_end - y_start
         return {'x': x_start, 'y': y_start, 'width': width, 'height': height} if width > 0 and height > 0 else None
 
-    def get_bounds(self) -> QuadBounds:
+    def _compute_bounds(self) -> QuadBounds:
         return QuadBounds.from_start_end(self.start, self.end)
 
 
 class NumberStampAction(DrawingAction):
+    __slots__ = ('position', 'number', 'creation_time')
+
     def __init__(self, position: tuple[int, int], number: int, options):
         super().__init__()
         self.options = options
@@ -733,38 +1047,39 @@ class NumberStampAction(DrawingAction):
         self.number = number
         self.creation_time = time.time()
 
-    def draw(self, cr: cairo.Context, image_to_widget_coords: Callable[[int, int], tuple[float, float]], scale: float):
-        x_widget, y_widget = image_to_widget_coords(*self.position)
+    def draw(self, cr: cairo.Context, transform: CoordTransform, scale: float):
+        x_widget, y_widget = transform.apply_xy(*self.position)
         r_widget = self.options.size * 2 * scale
 
-        cr.set_source_rgba(*self.options.fill_color)
+        cr.set_source_rgba(*self.options.fill_rgba)
         cr.arc(x_widget, y_widget, r_widget, 0, 2 * math.pi)
         cr.fill_preserve()
 
-        if self.options.border_color.alpha != 0 and self.options.fill_color.alpha != 0:
-            cr.set_source_rgba(*self.options.border_color)
+        if self.options.border_rgba[3] != 0 and self.options.fill_rgba[3] != 0:
+            cr.set_source_rgba(*self.options.border_rgba)
             cr.set_line_width(2.0 * scale)
             cr.stroke()
         else:
             cr.new_path()
 
+        font_size = r_widget * 1.2
         cr.select_font_face("Sans", cairo.FontSlant.NORMAL, cairo.FontWeight.BOLD)
-        cr.set_font_size(r_widget * 1.2)
+        cr.set_font_size(font_size)
         text = str(self.number)
 
-        xbearing, ybearing, width, height, xadvance, yadvance = cr.text_extents(text)
+        xbearing, width, height = (value * font_size for value in _get_number_extents(text))
         tx = x_widget - width / 2 - xbearing
         ty = y_widget + height / 2
 
         cr.move_to(tx, ty)
         cr.text_path(text)
 
-        if self.options.border_color and any(c > 0 for c in self.options.border_color):
-            cr.set_source_rgba(*self.options.border_color)
+        if any(c > 0 for c in self.options.border_rgba):
+            cr.set_source_rgba(*self.options.border_rgba)
             cr.set_line_width(4 * scale)
             cr.stroke_preserve()
 
-        cr.set_source_rgba(*self.options.primary_color)
+        cr.set_source_rgba(*self.options.primary_rgba)
         cr.fill()
 
     def contains_point(self, px_img: int, py_img: int) -> bool:
@@ -773,11 +1088,62 @@ class NumberStampAction(DrawingAction):
         distance_sq = (px_img - x_img)**2 + (py_img - y_img)**2
         return distance_sq <= (radius + 5)**2
 
-    def get_bounds(self) -> QuadBounds:
+    def _compute_bounds(self) -> QuadBounds:
         x_img, y_img = self.position
-        outline_padding = 2 if self.options.border_color and any(c > 0 for c in self.options.border_color) else 0
+        outline_padding = 2 if any(c > 0 for c in self.options.border_rgba) else 0
         total_radius = self.options.size * 2 + outline_padding + 1
         return QuadBounds.from_rect(x_img - total_radius, y_img - total_radius, x_img + total_radius, y_img + total_radius)
 
+    def _get_bounds_key(self) -> tuple:
+        return (self.position, self.options.revision)
+
     def translate(self, dx: int, dy: int):
+        bounds = self._get_valid_bounds_cache()
         self.position = (self.position[0] + dx, self.position[1] + dy)
+        self._set_translated_bounds(bounds, dx, dy)
+
+
+CULL_MARGIN = 2.0
+
+
+def draw_actions(cr: cairo.Context, actions: list[DrawingAction], transform: CoordTransform, scale: float):
+    # Runs of consecutive actions with the same batch key are emitted as a
+    # single path with the Cairo state set once. Only consecutive actions
+    # are merged so the painting order stays the same.
+    # Actions whose bounds fall entirely outside the clip are skipped.
+    clip_x0, clip_y0, clip_x1, clip_y1 = cr.clip_extents()
+    clip_x0 -= CULL_MARGIN
+    clip_y0 -= CULL_MARGIN
+    clip_x1 += CULL_MARGIN
+    clip_y1 += CULL_MARGIN
+    sx, sy, tx, ty = transform.sx, transform.sy, transform.tx, transform.ty
+
+    batch_key = None
+    for action in actions:
+        min_x, min_y, max_x, max_y = action.get_bounds().get_bounding_rect()
+        if (max_x * sx + tx < clip_x0 or min_x * sx + tx > clip_x1 or
+                max_y * sy + ty < clip_y0 or min_y * sy + ty > clip_y1):
+            continue
+
+        key = action.get_batch_key()
+        if key is not None and key == batch_key:
+            action.append_batch_path(cr, transform)
+            continue
+
+        if batch_key is not None:
+            cr.stroke()
+        batch_key = key
+
+        if key is None:
+            action.draw(cr, transform, scale)
+            continue
+
+        color, size = key
+        cr.set_source_rgba(*color)
+        cr.set_line_width(size * scale)
+        cr.set_line_cap(cairo.LineCap.ROUND)
+        cr.set_line_join(cairo.LineJoin.ROUND)
+        action.append_batch_path(cr, transform)
+
+    if batch_key is not None:
+        cr.stroke()
@@ -16,6 +16,8 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import cairo
+import os
+from concurrent.futures import ThreadPoolExecutor
 from gi.repository import Adw, Gdk, Gio, Gtk, GObject
 from typing import Tuple
 from enum import Enum
@@ -24,6 +26,9 @@ from gradia.overlay.drawing_actions import *
 from gradia.overlay.text_entry_popover import TextEntryPopover
 
 HANDLE_SIZE = 8
+PARALLEL_RENDER_MIN_ACTIONS = 24
+PARALLEL_RENDER_MAX_WORKERS = 8
+PARALLEL_RENDER_MIN_TILE_HEIGHT = 64
 
 class ResizeHandle(Enum):
     NONE = "none"
@@ -67,6 +72,7 @@ class DrawingOverlay(Gtk.DrawingArea):
         self.delta_transform = None
 
         self.picture_widget = None
+        self._background_cache: tuple[Gdk.Texture, cairo.ImageSurface] | None = None
         self.options = None
         self.font_size = 22
         self.is_drawing = False
@@ -98,7 +104,11 @@ class DrawingOverlay(Gtk.DrawingArea):
 
     def set_picture_reference(self, picture: Gtk.Picture) -> None:
         self.picture_widget = picture
-        picture.connect("notify::paintable", lambda *args: self.queue_draw())
+        picture.connect("notify::paintable", self._on_paintable_changed)
+
+    def _on_paintable_changed(self, *args) -> None:
+        self._background_cache = None
+        self.queue_draw()
 
     def set_erase_selected_revealer(self, erase_selected_revealer: Gtk.Revealer) -> None:
         self.erase_selected_revealer = erase_selected_revealer
@@ -262,7 +272,7 @@ class DrawingOverlay(Gtk.DrawingArea):
 
         return img_x_centered, img_y_centered
 
-    def _image_to_widget_coords(self, x_image: int, y_image: int) -> Tuple[float, float]:
+    def _get_image_transform(self) -> CoordTransform:
         ox, oy, disp_w, disp_h = self._get_image_bounds()
         scale = self._get_scale_factor()
 
@@ -271,29 +281,41 @@ class DrawingOverlay(Gtk.DrawingArea):
         center_x_intrinsic = img_w_intrinsic / 2
         center_y_intrinsic = img_h_intrinsic / 2
 
-        img_x_intrinsic_top_left = center_x_intrinsic + x_image
-        img_y_intrinsic_top_left = center_y_intrinsic + y_image
-
-        rel_x_on_disp_image = img_x_intrinsic_top_left * scale
-        rel_y_on_disp_image = img_y_intrinsic_top_left * scale
-
-        widget_x = ox + rel_x_on_disp_image
-        widget_y = oy + rel_y_on_disp_image
+        return CoordTransform(
+            scale,
+            scale,
+            ox + center_x_intrinsic * scale,
+            oy + center_y_intrinsic * scale
+        )
 
-        return widget_x, widget_y
+    def _image_to_widget_coords(self, x_image: int, y_image: int) -> Tuple[float, float]:
+        return self._get_image_transform().apply_xy(x_image, y_image)
 
     def _is_point_in_image(self, x_widget: float, y_widget: float) -> bool:
         ox, oy, dw, dh = self._get_image_bounds()
         return ox <= x_widget <= ox + dw and oy <= y_widget <= oy + dh
 
-    def _get_background_pixbuf(self):
+    def _get_background_surface(self) -> cairo.ImageSurface | None:
+        # All censor actions on an image share the same background, so it is
+        # converted to a Cairo surface once per texture
         if not self.picture_widget:
             return None
 
         paintable = self.picture_widget.get_paintable()
-        if isinstance(paintable, Gdk.Texture):
-            return Gdk.pixbuf_get_from_texture(paintable)
-        return None
+        if not isinstance(paintable, Gdk.Texture):
+            return None
+
+        cache = self._background_cache
+        if cache is not None and cache[0] is paintable:
+            return cache[1]
+
+        pixbuf = Gdk.pixbuf_get_from_texture(paintable)
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, pixbuf.get_width(), pixbuf.get_height())
+        surface_cr = cairo.Context(surface)
+        Gdk.cairo_set_source_pixbuf(surface_cr, pixbuf, 0, 0)
+        surface_cr.paint()
+        self._background_cache = (paintable, surface)
+        return surface
 
     def _setup_actions(self):
         for mode in DrawingMode:
@@ -627,18 +649,25 @@ class DrawingOverlay(Gtk.DrawingArea):
         cur_x_widget, cur_y_widget = start_x_widget + dx_widget, start_y_widget + dy_widget
         img_x, img_y = self._widget_to_image_coords(cur_x_widget, cur_y_widget)
 
+        # Image coordinates are rounded, so many pointer events land on the
+        # same pixel; skip the redraw when nothing visibly changed
+        previous_shift_pressed = self.current_shift_pressed
         self.update_shift_state(gesture)
 
         if self.options.mode == DrawingMode.SELECT and self.is_resizing and self.selected_action and self.resize_start_bounds:
+            previous_geometry = (self.selected_action.start, self.selected_action.end)
             self._resize_action(self.selected_action, self.resize_handle, self.resize_start_bounds,
                               self.resize_start_mouse, (img_x, img_y), self.current_shift_pressed)
-            self.queue_draw()
+            if (self.selected_action.start, self.selected_action.end) != previous_geometry:
+                self.queue_draw()
             return
 
         if self.options.mode == DrawingMode.SELECT and self.is_moving_selection and self.selected_action and self.move_start_point:
             old_x_img, old_y_img = self.move_start_point
             delta_x_img = img_x - old_x_img
             delta_y_img = img_y - old_y_img
+            if delta_x_img == 0 and delta_y_img == 0:
+                return
             self.selected_action.translate(delta_x_img, delta_y_img)
             self.move_start_point = (img_x, img_y)
             self.queue_draw()
@@ -648,8 +677,13 @@ class DrawingOverlay(Gtk.DrawingArea):
             return
 
         if self.options.mode == DrawingMode.PEN or self.options.mode == DrawingMode.HIGHLIGHTER:
+            unchanged = bool(self.current_stroke) and self.current_stroke[-1] == (img_x, img_y)
             self.current_stroke.append((img_x, img_y))
+            if unchanged and previous_shift_pressed == self.current_shift_pressed:
+                return
         else:
+            if self.end_point == (img_x, img_y) and previous_shift_pressed == self.current_shift_pressed:
+                return
             self.end_point = (img_x, img_y)
         self.queue_draw()
 
@@ -680,9 +714,11 @@ class DrawingOverlay(Gtk.DrawingArea):
         mode = self.options.mode
         if (mode == DrawingMode.PEN or mode == DrawingMode.HIGHLIGHTER) and len(self.current_stroke) > 1:
             if mode == DrawingMode.PEN:
-                self.actions.append(StrokeAction(self.current_stroke.copy(), self.options.copy()))
+                stroke_action = StrokeAction(self.current_stroke.copy(), self.options.copy())
             else:
-                self.actions.append(HighlighterAction(self.current_stroke.copy(), self.options.copy(), self.current_shift_pressed))
+                stroke_action = HighlighterAction(self.current_stroke.copy(), self.options.copy(), self.current_shift_pressed)
+            stroke_action.finalize()
+            self.actions.append(stroke_action)
             self.current_stroke.clear()
         elif self.start_point and self.end_point:
             if mode == DrawingMode.ARROW:
@@ -694,7 +730,7 @@ class DrawingOverlay(Gtk.DrawingArea):
             elif mode == DrawingMode.CIRCLE:
                 self.actions.append(CircleAction(self.start_point, self.end_point,self.current_shift_pressed, self.options.copy()))
             elif mode == DrawingMode.CENSOR:
-                censor_action = CensorAction(self.start_point, self.end_point, self._get_background_pixbuf(), self.options.copy())
+                censor_action = CensorAction(self.start_point, self.end_point, self._get_background_surface(), self.options.copy())
                 current_scale = self._get_scale_factor()
                 censor_action.set_original_scale(current_scale)
                 self.actions.append(censor_action)
@@ -760,36 +796,38 @@ class DrawingOverlay(Gtk.DrawingArea):
     def _on_draw(self, area, cr: cairo.Context, width: int, height: int):
         scale = self._get_scale_factor()
         ox, oy, dw, dh = self._get_image_bounds()
+        transform = self._get_image_transform()
 
         cr.set_line_cap(cairo.LineCap.ROUND)
         cr.set_line_join(cairo.LineJoin.ROUND)
         cr.rectangle(ox, oy, dw, dh)
         cr.clip()
 
-        for action in self.actions:
-            if action == self.editing_text_action and self.is_text_editing:
-                continue
-            action.draw(cr, self._image_to_widget_coords, scale)
+        if self.is_text_editing and self.editing_text_action:
+            visible_actions = [action for action in self.actions if action != self.editing_text_action]
+        else:
+            visible_actions = self.actions
+        draw_actions(cr, visible_actions, transform, scale)
 
         if self.is_drawing and self.options.mode != DrawingMode.TEXT and self.options.mode != DrawingMode.NUMBER:
-            cr.set_source_rgba(*self.options.primary_color)
+            cr.set_source_rgba(*self.options.primary_rgba)
             if self.options.mode == DrawingMode.PEN and len(self.current_stroke) > 1:
-                StrokeAction(self.current_stroke, self.options.copy()).draw(cr, self._image_to_widget_coords, scale)
+                StrokeAction(self.current_stroke, self.options.copy()).draw(cr, transform, scale)
             elif self.options.mode == DrawingMode.HIGHLIGHTER and len(self.current_stroke) > 1:
-                HighlighterAction(self.current_stroke, self.options.copy(), self.current_shift_pressed).draw(cr, self._image_to_widget_coords, scale)
+                HighlighterAction(self.current_stroke, self.options.copy(), self.current_shift_pressed).draw(cr, transform, scale)
             elif self.start_point and self.end_point:
                 if self.options.mode == DrawingMode.ARROW:
-                    ArrowAction(self.start_point, self.end_point,self.current_shift_pressed, self.options.copy()).draw(cr, self._image_to_widget_coords, scale)
+                    ArrowAction(self.start_point, self.end_point,self.current_shift_pressed, self.options.copy()).draw(cr, transform, scale)
                 elif self.options.mode == DrawingMode.LINE:
-                    LineAction(self.start_point, self.end_point,self.current_shift_pressed, self.options.copy()).draw(cr, self._image_to_widget_coords, scale)
+                    LineAction(self.start_point, self.end_point,self.current_shift_pressed, self.options.copy()).draw(cr, transform, scale)
                 elif self.options.mode == DrawingMode.SQUARE:
-                    RectAction(self.start_point, self.end_point, self.current_shift_pressed, self.options.copy()).draw(cr, self._image_to_widget_coords, scale)
+                    RectAction(self.start_point, self.end_point, self.current_shift_pressed, self.options.copy()).draw(cr, transform, scale)
                 elif self.options.mode == DrawingMode.CIRCLE:
-                    CircleAction(self.start_point, self.end_point, self.current_shift_pressed, self.options.copy()).draw(cr, self._image_to_widget_coords, scale)
+                    CircleAction(self.start_point, self.end_point, self.current_shift_pressed, self.options.copy()).draw(cr, transform, scale)
                 elif self.options.mode == DrawingMode.CENSOR:
-                    temp_censor = CensorAction(self.start_point, self.end_point, self._get_background_pixbuf(), self.options.copy())
+                    temp_censor = CensorAction(self.start_point, self.end_point, self._get_background_surface(), self.options.copy())
                     temp_censor.set_original_scale(scale)
-                    temp_censor.draw(cr, self._image_to_widget_coords, scale)
+                    temp_censor.draw(cr, transform, scale)
 
         if self.is_text_editing and self.text_position and self.live_text:
             if self.editing_text_action:
@@ -808,7 +846,7 @@ class DrawingOverlay(Gtk.DrawingArea):
                     self.options.copy(),
                     self.font_size
                 )
-            preview.draw(cr, self._image_to_widget_coords, scale)
+            preview.draw(cr, transform, scale)
 
         if self.selected_action:
             self._draw_selection_box(cr, scale)
@@ -889,19 +927,59 @@ def render_actions_to_pixbuf(actions: list[DrawingAction], width: int, height: i
     cr.paint()
     cr.set_operator(cairo.Operator.OVER)
 
-    def image_coords_to_intrinsic_pixels(x_image: int, y_image: int) -> Tuple[float, float]:
-        center_x_intrinsic = width / 2.0
-        center_y_intrinsic = height / 2.0
-        return (center_x_intrinsic + x_image * scale_factor_x, center_y_intrinsic + y_image * scale_factor_y)
-
     cr.set_line_cap(cairo.LineCap.ROUND)
     cr.set_line_join(cairo.LineJoin.ROUND)
 
     scale_factor = (scale_factor_x + scale_factor_y) / 2.0
+    transform = CoordTransform(scale_factor_x, scale_factor_y, width / 2.0, height / 2.0)
 
-    for action in actions:
-        action.draw(cr, image_coords_to_intrinsic_pixels, scale_factor)
+    tile_count = min(_get_render_worker_count(), height // PARALLEL_RENDER_MIN_TILE_HEIGHT)
+    if (tile_count > 1 and len(actions) >= PARALLEL_RENDER_MIN_ACTIONS and
+            all(action.PARALLEL_SAFE for action in actions)):
+        _draw_actions_tiled(cr, actions, width, height, transform, scale_factor, tile_count)
+    else:
+        draw_actions(cr, actions, transform, scale_factor)
 
     surface.flush()
 
     return Gdk.pixbuf_get_from_surface(surface, 0, 0, width, height)
+
+
+def _get_render_worker_count() -> int:
+    return min(max(1, (os.cpu_count() or 1) * 2 // 3), PARALLEL_RENDER_MAX_WORKERS)
+
+
+def _render_tile(actions: list[DrawingAction], width: int, y0: int, tile_height: int, transform: CoordTransform, scale_factor: float) -> cairo.ImageSurface:
+    surface = cairo.ImageSurface(cairo.Format.ARGB32, width, tile_height)
+    cr = cairo.Context(surface)
+    # An integer offset keeps the rasterization identical to a single pass,
+    # draw_actions culls everything outside the tile through the clip
+    cr.translate(0, -y0)
+    cr.set_line_cap(cairo.LineCap.ROUND)
+    cr.set_line_join(cairo.LineJoin.ROUND)
+    draw_actions(cr, actions, transform, scale_factor)
+    surface.flush()
+    return surface
+
+
+def _draw_actions_tiled(cr: cairo.Context, actions: list[DrawingAction], width: int, height: int, transform: CoordTransform, scale_factor: float, tile_count: int):
+    # Every tile draws all actions touching it in their original order, so
+    # overlapping actions and the highlighter's MULTIPLY blending come out the
+    # same as when drawing in one pass. Tiles do not overlap and are pasted
+    # onto a cleared surface. Bounds are filled in here so the workers only
+    # read the cached values. This function itself may be called off the main
+    # thread, see DrawingAction.PARALLEL_SAFE.
+    for action in actions:
+        action.get_bounds().get_bounding_rect()
+
+    tile_height = -(-height // tile_count)
+    tiles = [(y0, min(tile_height, height - y0)) for y0 in range(0, height, tile_height)]
+
+    with ThreadPoolExecutor(max_workers=len(tiles)) as executor:
+        futures = [
+            executor.submit(_render_tile, actions, width, y0, h, transform, scale_factor)
+            for y0, h in tiles
+        ]
+        for (y0, _), future in zip(tiles, futures):
+            cr.set_source_surface(future.result(), 0, y0)
+            cr.paint()